@@ -1,43 +1,194 @@
 import os
+import queue
 import sqlite3
+import threading
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Iterator, Optional
 
 # Local dev default: data/app.db
 # On Render: set DB_PATH=/data/app.db (persistent disk mount)
 DB_PATH = Path(os.environ.get("DB_PATH", "data/app.db"))
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5"))
+POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "5"))
 
-def get_conn() -> sqlite3.Connection:
+# Per-connection tuning. journal_mode=WAL is persistent in the db file,
+# so it is set once in init_db() instead of on every connect.
+CONN_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL;",
+    "PRAGMA temp_store=MEMORY;",
+    "PRAGMA cache_size=-64000;",
+    "PRAGMA mmap_size=268435456;",
+    "PRAGMA busy_timeout=5000;",
+)
+
+def _connect() -> sqlite3.Connection:
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(
+        DB_PATH, check_same_thread=False, isolation_level=None, cached_statements=256
+    )
     conn.row_factory = sqlite3.Row
+    for pragma in CONN_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
-def init_db() -> None:
-    conn = get_conn()
-    cur = conn.cursor()
 
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS businesses (
+class PoolTimeout(Exception):
+    """No pooled connection became free within POOL_TIMEOUT seconds."""
+
+
+class ConnectionPool:
+    """Fixed-size pool of long-lived connections shared by request threads."""
+
+    def __init__(self, size: int = POOL_SIZE):
+        self._queue: "queue.Queue[sqlite3.Connection]" = queue.Queue(maxsize=size)
+        self._closed = False
+        self._lock = threading.Lock()
+        for _ in range(size):
+            self._queue.put(_connect())
+
+    def get(self, timeout: float = POOL_TIMEOUT) -> sqlite3.Connection:
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            raise PoolTimeout(f"no database connection free after {timeout}s") from None
+
+    def put(self, conn: sqlite3.Connection) -> None:
+        # Never hand a half-finished transaction to the next request
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if not self._closed:
+                self._queue.put(conn)
+                return
+        # Checked out across close(): nobody will drain it, so close it here
+        conn.close()
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                conn = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            # optimize looks at the tables this connection actually queried
+            conn.execute("PRAGMA optimize;")
+            conn.close()
+
+
+_pool: Optional[ConnectionPool] = None
+
+
+@contextmanager
+def get_conn() -> Iterator[sqlite3.Connection]:
+    pool = _pool
+    if pool is None:
+        raise RuntimeError("Connection pool not initialised; call init_db() first")
+    conn = pool.get()
+    try:
+        yield conn
+    finally:
+        pool.put(conn)
+
+
+@contextmanager
+def open_conn() -> Iterator[sqlite3.Connection]:
+    """A one-off connection outside the pool, for long-lived work such as
+    streaming exports that would otherwise starve request handlers."""
+    conn = _connect()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def close_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+
+
+# created_at is unix epoch seconds: integer compares and smaller index pages
+# than ISO-8601 text. strftime('%s') rather than unixepoch() for SQLite < 3.38.
+SCHEMA = {
+    "businesses": """
+    CREATE TABLE IF NOT EXISTS {name} (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         slug TEXT UNIQUE NOT NULL,
         name TEXT NOT NULL,
-        created_at TEXT DEFAULT (datetime('now'))
+        created_at INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
     );
-    """)
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS reviews (
+    """,
+    "reviews": """
+    CREATE TABLE IF NOT EXISTS {name} (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         business_id INTEGER NOT NULL,
         rating INTEGER NOT NULL CHECK (rating BETWEEN 1 AND 5),
         comment TEXT,
         contact_email TEXT,
-        created_at TEXT DEFAULT (datetime('now')),
+        created_at INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
         seen INTEGER DEFAULT 0,
         flagged INTEGER DEFAULT 0,
         FOREIGN KEY (business_id) REFERENCES businesses(id)
     );
+    """,
+}
+
+
+def _migrate_text_timestamps(cur: sqlite3.Cursor, table: str) -> None:
+    """Rebuild a table created with TEXT created_at as INTEGER epoch seconds."""
+    # Take the write lock before looking, so concurrent workers starting up
+    # re-check after the first one has migrated instead of converting twice
+    cur.execute("BEGIN IMMEDIATE;")
+    try:
+        cols = {r["name"]: r["type"] for r in cur.execute(f"PRAGMA table_info({table});")}
+        if cols.get("created_at", "").upper() != "TEXT":
+            cur.execute("COMMIT;")
+            return
+
+        names = ", ".join(cols)
+        converted = ", ".join(
+            "CASE WHEN typeof(created_at) = 'text'"
+            " THEN CAST(strftime('%s', created_at) AS INTEGER)"
+            " ELSE created_at END"
+            if c == "created_at" else c
+            for c in cols
+        )
+        # Copy-drop-rename keeps other tables' REFERENCES pointing at the right name
+        cur.execute(SCHEMA[table].format(name=f"{table}_new"))
+        cur.execute(f"INSERT INTO {table}_new ({names}) SELECT {converted} FROM {table};")
+        cur.execute(f"DROP TABLE {table};")
+        cur.execute(f"ALTER TABLE {table}_new RENAME TO {table};")
+        cur.execute("COMMIT;")
+    except Exception:
+        cur.execute("ROLLBACK;")
+        raise
+
+
+def init_db() -> None:
+    global _pool
+    conn = _connect()
+    conn.execute("PRAGMA journal_mode=WAL;")
+    cur = conn.cursor()
+
+    for table, ddl in SCHEMA.items():
+        cur.execute(ddl.format(name=table))
+        _migrate_text_timestamps(cur, table)
+    # Newest-first reads: the unfiltered dashboard and the CSV export walk
+    # idx_reviews_created, the per-business dashboard idx_reviews_business_created.
+    # No rating index: with five values it only tempts the planner into a
+    # rowid lookup per row plus a sort.
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_reviews_created
+    ON reviews(created_at DESC);
+    """)
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_reviews_business_created
+    ON reviews(business_id, created_at DESC);
     """)
+    cur.execute("DROP INDEX IF EXISTS idx_reviews_rating_created;")
 
     # Seed demo business
     cur.execute(
@@ -45,5 +196,10 @@ def init_db() -> None:
         ("demo", "Demo Shop")
     )
 
-    conn.commit()
+    # Re-analyzes only tables whose stats are missing or stale; cheap to run
+    # on every startup, unlike a full ANALYZE
+    cur.execute("PRAGMA optimize;")
     conn.close()
+
+    if _pool is None:
+        _pool = ConnectionPool()
@@ -1,21 +1,55 @@
 import os
 import csv
+import hmac
 import io
+import queue
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Dict, List, Optional
+import jinja2
 from fastapi import FastAPI, Request, Form, Depends, HTTPException
-from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from itsdangerous import URLSafeSerializer, BadSignature
 
-from app.db import init_db, get_conn
-from app.models import ReviewCreate
+from app.db import init_db, get_conn, open_conn, close_pool, PoolTimeout
+from app.models import Business, ReviewCreate
 
 app = FastAPI(title="QR Feedback MVP")
 
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
-templates = Jinja2Templates(directory="app/templates")
+
+# Templates never change while a deployed worker runs: skip mtime checks and
+# share compiled bytecode across workers/restarts via the filesystem. With no
+# JINJA_CACHE_DIR, Jinja picks a private per-user directory (mode 0700, owner
+# checked); an explicit JINJA_CACHE_DIR must already exist and be trusted.
+_jinja_cache_dir = os.environ.get("JINJA_CACHE_DIR")
+templates = Jinja2Templates(env=jinja2.Environment(
+    loader=jinja2.FileSystemLoader("app/templates"),
+    autoescape=True,
+    auto_reload=os.environ.get("TEMPLATES_AUTO_RELOAD") == "1",
+    cache_size=400,
+    bytecode_cache=(
+        jinja2.FileSystemBytecodeCache(_jinja_cache_dir)
+        if _jinja_cache_dir else jinja2.FileSystemBytecodeCache()
+    ),
+))
+
+
+def _format_ts(ts: Optional[int]) -> str:
+    # created_at is stored as unix epoch seconds (UTC)
+    if ts is None:
+        return ""
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+templates.env.filters["ts"] = _format_ts
 
 ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD", "")
+_ADMIN_PW_BYTES = ADMIN_PASSWORD.encode() if ADMIN_PASSWORD else None
 SECRET = os.environ.get("SESSION_SECRET", "dev-secret-change-this")
 serializer = URLSafeSerializer(SECRET, salt="admin-session")
 
@@ -23,6 +57,18 @@ serializer = URLSafeSerializer(SECRET, salt="admin-session")
 @app.on_event("startup")
 def _startup():
     init_db()
+    _load_businesses()
+
+
+@app.on_event("shutdown")
+def _shutdown():
+    close_pool()
+
+
+@app.exception_handler(PoolTimeout)
+def _pool_timeout(request: Request, exc: PoolTimeout):
+    # Every pooled connection is busy; tell the client to retry instead of hanging
+    return PlainTextResponse("Service busy, try again shortly", status_code=503, headers={"Retry-After": "1"})
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -36,42 +82,75 @@ def favicon():
     return RedirectResponse("/static/favicon.ico")
 
 
-def require_admin(request: Request):
-    token = request.cookies.get("admin_session")
-    if not token:
-        raise HTTPException(status_code=401, detail="Not authenticated")
+@lru_cache(maxsize=512)
+def _verify(token: str) -> bool:
+    # SECRET is fixed for the process, so a token's validity never changes
     try:
         data = serializer.loads(token)
-        if data.get("admin") is True:
-            return True
     except BadSignature:
-        pass
+        return False
+    return isinstance(data, dict) and data.get("admin") is True
+
+
+def require_admin(request: Request):
+    token = request.cookies.get("admin_session")
+    if token and _verify(token):
+        return True
     raise HTTPException(status_code=401, detail="Not authenticated")
 
 
-def get_business_by_slug(slug: str):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM businesses WHERE slug = ?;", (slug,))
-    row = cur.fetchone()
-    conn.close()
-    return row
+# Businesses are few and rarely added: keep slug -> Business in memory,
+# loaded at startup and filled in as new slugs show up.
+_BIZ_BY_SLUG: Dict[str, Business] = {}
+_BIZ_LOCK = threading.Lock()
 
 
-def get_or_create_business(slug: str):
-    row = get_business_by_slug(slug)
-    if row:
-        return row
+def _load_businesses() -> None:
+    with get_conn() as conn:
+        rows = conn.execute("SELECT id, slug, name FROM businesses;").fetchall()
+    with _BIZ_LOCK:
+        _BIZ_BY_SLUG.clear()
+        _BIZ_BY_SLUG.update((r["slug"], Business(*r)) for r in rows)
+
+
+def _remember_business(biz: Business) -> Business:
+    with _BIZ_LOCK:
+        return _BIZ_BY_SLUG.setdefault(biz.slug, biz)
+
+
+def get_business_by_slug(slug: str) -> Optional[Business]:
+    biz = _BIZ_BY_SLUG.get(slug)
+    if biz:
+        return biz
+
+    # May have been created by another worker since startup
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id, slug, name FROM businesses WHERE slug = ?;", (slug,))
+        row = cur.fetchone()
+    return _remember_business(Business(*row)) if row else None
+
+
+def _default_business_name(slug: str) -> str:
+    return slug.replace("-", " ").title()
 
-    conn = get_conn()
-    cur = conn.cursor()
-    name = slug.replace("-", " ").title()
-    cur.execute("INSERT INTO businesses (slug, name) VALUES (?, ?);", (slug, name))
-    conn.commit()
-    cur.execute("SELECT * FROM businesses WHERE slug = ?;", (slug,))
-    row = cur.fetchone()
-    conn.close()
-    return row
+
+def get_or_create_business(slug: str) -> Business:
+    biz = get_business_by_slug(slug)
+    if biz:
+        return biz
+
+    name = _default_business_name(slug)
+    with get_conn() as conn:
+        cur = conn.cursor()
+        # OR IGNORE: another worker may have created it since our lookup
+        cur.execute("INSERT OR IGNORE INTO businesses (slug, name) VALUES (?, ?);", (slug, name))
+        if cur.rowcount == 1:
+            biz = Business(cur.lastrowid, slug, name)
+        else:
+            cur.execute("SELECT id, slug, name FROM businesses WHERE slug = ?;", (slug,))
+            biz = Business(*cur.fetchone())
+    return _remember_business(biz)
 
 
 # -----------------------
@@ -80,9 +159,9 @@ def get_or_create_business(slug: str):
 @app.get("/r/{slug}", response_class=HTMLResponse)
 def review_form(request: Request, slug: str):
     biz = get_or_create_business(slug)
-    return templates.TemplateResponse("review_form.html", {
-        "request": request,
-        "business": dict(biz),
+    return templates.TemplateResponse(request, "review_form.html", {
+        "business_slug": biz.slug,
+        "business_name": biz.name,
         "success": request.query_params.get("success") == "1",
     })
 
@@ -94,12 +173,12 @@ def submit_review_form(
     comment: str = Form(""),
     contact_email: str = Form(""),
 ):
-    payload = ReviewCreate(
-        business_slug=slug,
-        rating=int(rating),
-        comment=comment.strip() or None,
-        contact_email=contact_email.strip() or None,
-    )
+    payload = ReviewCreate.model_validate({
+        "business_slug": slug,
+        "rating": rating,
+        "comment": comment.strip() or None,
+        "contact_email": contact_email.strip() or None,
+    })
     create_review(payload)
     return RedirectResponse(url=f"/r/{slug}?success=1", status_code=303)
 
@@ -107,21 +186,67 @@ def submit_review_form(
 # -----------------------
 # API
 # -----------------------
-@app.post("/api/reviews")
-def create_review(payload: ReviewCreate):
-    biz = get_or_create_business(payload.business_slug)
-    flagged = 1 if payload.rating <= 2 else 0
-
-    conn = get_conn()
+def _insert_reviews(conn: sqlite3.Connection, payloads: List[ReviewCreate]) -> List[bool]:
+    new_slugs = {p.business_slug for p in payloads if p.business_slug not in _BIZ_BY_SLUG}
+    rows = []
+    for payload in payloads:
+        flagged = 1 if payload.rating <= 2 else 0
+        rows.append((payload.rating, payload.comment, payload.contact_email, flagged, payload.business_slug))
+
+    created: List[Business] = []
     cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO reviews (business_id, rating, comment, contact_email, flagged)
-        VALUES (?, ?, ?, ?, ?);
-    """, (biz["id"], payload.rating, payload.comment, payload.contact_email, flagged))
-    conn.commit()
-    conn.close()
+    cur.execute("BEGIN;")
+    try:
+        # Business lookup happens inside the INSERT, so the whole batch
+        # needs one connection and one commit
+        if new_slugs:
+            cur.executemany(
+                "INSERT OR IGNORE INTO businesses (slug, name) VALUES (?, ?);",
+                [(slug, _default_business_name(slug)) for slug in new_slugs],
+            )
+            placeholders = ", ".join("?" * len(new_slugs))
+            cur.execute(
+                f"SELECT id, slug, name FROM businesses WHERE slug IN ({placeholders});",
+                tuple(new_slugs),
+            )
+            created = [Business(*r) for r in cur.fetchall()]
+        cur.executemany("""
+            INSERT INTO reviews (business_id, rating, comment, contact_email, flagged)
+            SELECT id, ?, ?, ?, ? FROM businesses WHERE slug = ?;
+        """, rows)
+        # INSERT ... SELECT silently inserts nothing if the slug has no business
+        if cur.rowcount != len(rows):
+            raise RuntimeError(f"inserted {cur.rowcount} of {len(rows)} reviews")
+        cur.execute("COMMIT;")
+    except Exception:
+        cur.execute("ROLLBACK;")
+        raise
+
+    # Later submissions for these slugs skip the INSERT OR IGNORE above
+    for biz in created:
+        _remember_business(biz)
+    return [bool(row[3]) for row in rows]
+
+
+def create_reviews_bulk(
+    payloads: List[ReviewCreate], conn: Optional[sqlite3.Connection] = None
+) -> List[bool]:
+    """Insert many reviews in one transaction (one fsync for the whole batch).
+
+    Missing businesses are created in the same transaction. Pass ``conn`` to
+    reuse a connection the caller already holds. Returns the flagged state
+    of each review, in input order.
+    """
+    if conn is not None:
+        return _insert_reviews(conn, payloads)
+    with get_conn() as conn:
+        return _insert_reviews(conn, payloads)
 
-    return {"ok": True, "flagged": bool(flagged)}
+
+@app.post("/api/reviews")
+def create_review(payload: ReviewCreate):
+    flagged = create_reviews_bulk([payload])[0]
+    return {"ok": True, "flagged": flagged}
 
 
 # -----------------------
@@ -129,20 +254,18 @@ def create_review(payload: ReviewCreate):
 # -----------------------
 @app.get("/admin/login", response_class=HTMLResponse)
 def admin_login_page(request: Request):
-    return templates.TemplateResponse("admin_login.html", {"request": request, "error": None})
+    return templates.TemplateResponse(request, "admin_login.html", {"error": None})
 
 
 @app.post("/admin/login", response_class=HTMLResponse)
 def admin_login(request: Request, password: str = Form(...)):
-    if not ADMIN_PASSWORD:
-        return templates.TemplateResponse("admin_login.html", {
-            "request": request,
+    if not _ADMIN_PW_BYTES:
+        return templates.TemplateResponse(request, "admin_login.html", {
             "error": "Server missing ADMIN_PASSWORD env var"
         })
 
-    if password != ADMIN_PASSWORD:
-        return templates.TemplateResponse("admin_login.html", {
-            "request": request,
+    if not hmac.compare_digest(password.encode(), _ADMIN_PW_BYTES):
+        return templates.TemplateResponse(request, "admin_login.html", {
             "error": "Wrong password"
         })
 
@@ -154,6 +277,7 @@ def admin_login(request: Request, password: str = Form(...)):
 
 @app.get("/admin/logout")
 def admin_logout():
+    _verify.cache_clear()
     resp = RedirectResponse(url="/admin/login", status_code=303)
     resp.delete_cookie("admin_session")
     return resp
@@ -162,6 +286,24 @@ def admin_logout():
 # -----------------------
 # Admin dashboard
 # -----------------------
+# Fixed SQL text (no concatenation) so sqlite3's statement cache can reuse them
+ADMIN_SQL_ALL = """
+SELECT r.*, b.slug AS business_slug, b.name AS business_name
+FROM reviews r
+JOIN businesses b ON b.id = r.business_id
+WHERE r.rating >= ?
+ORDER BY r.created_at DESC LIMIT 200;
+"""
+
+ADMIN_SQL_FILTERED = """
+SELECT r.*, b.slug AS business_slug, b.name AS business_name
+FROM reviews r
+JOIN businesses b ON b.id = r.business_id
+WHERE r.rating >= ? AND r.business_id = ?
+ORDER BY r.created_at DESC LIMIT 200;
+"""
+
+
 @app.get("/admin", response_class=HTMLResponse)
 def admin_dashboard(
     request: Request,
@@ -169,32 +311,23 @@ def admin_dashboard(
     business: str = "",
     _: bool = Depends(require_admin),
 ):
-    conn = get_conn()
-    cur = conn.cursor()
-
-    cur.execute("SELECT slug, name FROM businesses ORDER BY name;")
-    businesses = [dict(r) for r in cur.fetchall()]
-
-    query = """
-    SELECT r.*, b.slug AS business_slug, b.name AS business_name
-    FROM reviews r
-    JOIN businesses b ON b.id = r.business_id
-    WHERE r.rating >= ?
-    """
-    params = [min_rating]
-
     if business:
-        query += " AND b.slug = ?"
-        params.append(business)
+        # Filter on business_id so the query hits idx_reviews_business_created
+        biz = get_business_by_slug(business)
+        query, params = ADMIN_SQL_FILTERED, (min_rating, biz.id if biz else -1)
+    else:
+        query, params = ADMIN_SQL_ALL, (min_rating,)
+
+    with get_conn() as conn:
+        cur = conn.cursor()
 
-    query += " ORDER BY r.created_at DESC LIMIT 200;"
-    cur.execute(query, tuple(params))
-    reviews = [dict(r) for r in cur.fetchall()]
+        cur.execute("SELECT slug, name FROM businesses ORDER BY name;")
+        businesses = [dict(r) for r in cur.fetchall()]
 
-    conn.close()
+        cur.execute(query, params)
+        reviews = [dict(r) for r in cur.fetchall()]
 
-    return templates.TemplateResponse("admin_dashboard.html", {
-        "request": request,
+    return templates.TemplateResponse(request, "admin_dashboard.html", {
         "reviews": reviews,
         "businesses": businesses,
         "min_rating": min_rating,
@@ -204,40 +337,74 @@ def admin_dashboard(
 
 @app.post("/admin/reviews/{review_id}/seen")
 def mark_seen(review_id: int, _: bool = Depends(require_admin)):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("UPDATE reviews SET seen = 1 WHERE id = ?;", (review_id,))
-    conn.commit()
-    conn.close()
+    with get_conn() as conn:
+        conn.execute("UPDATE reviews SET seen = 1 WHERE id = ?;", (review_id,))
     return RedirectResponse(url="/admin", status_code=303)
 
 
+# Walks idx_reviews_created newest-first, so rows stream out without SQLite
+# first sorting the whole result
+EXPORT_SQL = """
+SELECT b.slug AS business_slug, b.name AS business_name,
+       r.rating, r.comment, r.contact_email,
+       datetime(r.created_at, 'unixepoch') AS created_at, r.seen, r.flagged
+FROM reviews r
+JOIN businesses b ON b.id = r.business_id
+ORDER BY r.created_at DESC;
+"""
+
+EXPORT_CHUNK_ROWS = 500
+EXPORT_WRITER_POOL_SIZE = 4
+
+
+def _new_csv_writer():
+    # Encode straight into a bytes buffer so chunks go out without a str->bytes copy
+    buf = io.BytesIO()
+    text = io.TextIOWrapper(buf, encoding="utf-8", newline="", write_through=True)
+    return buf, csv.writer(text)
+
+
+_csv_writers: "queue.LifoQueue" = queue.LifoQueue(maxsize=EXPORT_WRITER_POOL_SIZE)
+for _ in range(EXPORT_WRITER_POOL_SIZE):
+    _csv_writers.put(_new_csv_writer())
+
+
+def _csv_iter():
+    # Own connection, not a pooled one: a slow download must not tie up the pool
+    with open_conn() as conn:
+        cur = conn.cursor()
+        cur.row_factory = None  # plain tuples, already in column order
+        cur.execute(EXPORT_SQL)
+
+        try:
+            buf, w = _csv_writers.get_nowait()
+        except queue.Empty:
+            buf, w = _new_csv_writer()
+        try:
+            w.writerow(["business_slug", "business_name", "rating", "comment", "contact_email", "created_at", "seen", "flagged"])
+            yield buf.getvalue()
+
+            while True:
+                rows = cur.fetchmany(EXPORT_CHUNK_ROWS)
+                if not rows:
+                    break
+                buf.seek(0)
+                buf.truncate(0)
+                w.writerows(rows)
+                yield buf.getvalue()
+        finally:
+            buf.seek(0)
+            buf.truncate(0)
+            try:
+                _csv_writers.put_nowait((buf, w))
+            except queue.Full:
+                pass  # overflow pair from a busy moment; let it be collected
+
+
 @app.get("/admin/export.csv")
 def export_csv(_: bool = Depends(require_admin)):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""
-    SELECT b.slug AS business_slug, b.name AS business_name,
-           r.rating, r.comment, r.contact_email, r.created_at, r.seen, r.flagged
-    FROM reviews r
-    JOIN businesses b ON b.id = r.business_id
-    ORDER BY r.created_at DESC;
-    """)
-    rows = cur.fetchall()
-    conn.close()
-
-    buf = io.StringIO()
-    w = csv.writer(buf)
-    w.writerow(["business_slug", "business_name", "rating", "comment", "contact_email", "created_at", "seen", "flagged"])
-    for r in rows:
-        w.writerow([
-            r["business_slug"], r["business_name"], r["rating"], r["comment"],
-            r["contact_email"], r["created_at"], r["seen"], r["flagged"]
-        ])
-
-    buf.seek(0)
     return StreamingResponse(
-        iter([buf.getvalue()]),
-        media_type="text/csv",
+        _csv_iter(),
+        media_type="text/csv; charset=utf-8",
         headers={"Content-Disposition": "attachment; filename=reviews.csv"}
     )
@@ -0,0 +1,123 @@
+import multiprocessing
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+from app import db
+
+# Schema as shipped before created_at became INTEGER epoch seconds
+BASELINE_SCHEMA = """
+CREATE TABLE businesses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    slug TEXT UNIQUE NOT NULL,
+    name TEXT NOT NULL,
+    created_at TEXT DEFAULT (datetime('now'))
+);
+CREATE TABLE reviews (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    business_id INTEGER NOT NULL,
+    rating INTEGER NOT NULL CHECK (rating BETWEEN 1 AND 5),
+    comment TEXT,
+    contact_email TEXT,
+    created_at TEXT DEFAULT (datetime('now')),
+    seen INTEGER DEFAULT 0,
+    flagged INTEGER DEFAULT 0,
+    FOREIGN KEY (business_id) REFERENCES businesses(id)
+);
+"""
+
+TS_TEXT = "2024-03-01 12:00:00"
+TS_EPOCH = 1709294400
+
+
+def _seed_baseline(path: Path, reviews: int) -> None:
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.execute(
+        "INSERT INTO businesses (slug, name, created_at) VALUES ('demo', 'Demo Shop', ?);",
+        (TS_TEXT,),
+    )
+    conn.executemany(
+        "INSERT INTO reviews (business_id, rating, comment, created_at) VALUES (1, ?, ?, ?);",
+        [(i % 5 + 1, f"review {i}", TS_TEXT) for i in range(reviews)],
+    )
+    conn.commit()
+    conn.close()
+
+
+def _init_in_child(path: str) -> None:
+    db.DB_PATH = Path(path)
+    db.init_db()
+    db.close_pool()
+
+
+class MigrateTimestampsTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self._tmp.name) / "app.db"
+        self._orig_path = db.DB_PATH
+        db.DB_PATH = self.path
+
+    def tearDown(self):
+        db.close_pool()
+        db.DB_PATH = self._orig_path
+        self._tmp.cleanup()
+
+    def _created_at(self, table):
+        conn = sqlite3.connect(self.path)
+        rows = conn.execute(f"SELECT created_at, typeof(created_at) FROM {table};").fetchall()
+        decl = {r[1]: r[2] for r in conn.execute(f"PRAGMA table_info({table});")}["created_at"]
+        conn.close()
+        return rows, decl
+
+    def test_migrates_baseline_db(self):
+        _seed_baseline(self.path, reviews=100)
+
+        db.init_db()
+        db.init_db()  # second run must be a no-op
+
+        for table, count in (("businesses", 1), ("reviews", 100)):
+            rows, decl = self._created_at(table)
+            self.assertEqual(decl, "INTEGER")
+            self.assertEqual(len(rows), count)
+            self.assertEqual(set(rows), {(TS_EPOCH, "integer")})
+
+    def test_concurrent_init_keeps_timestamps(self):
+        _seed_baseline(self.path, reviews=20000)
+
+        ctx = multiprocessing.get_context("spawn")
+        procs = [ctx.Process(target=_init_in_child, args=(str(self.path),)) for _ in range(4)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+            self.assertEqual(p.exitcode, 0)
+
+        rows, decl = self._created_at("reviews")
+        self.assertEqual(decl, "INTEGER")
+        self.assertEqual(len(rows), 20000)
+        self.assertEqual(set(rows), {(TS_EPOCH, "integer")})
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._orig_path = db.DB_PATH
+        db.DB_PATH = Path(self._tmp.name) / "app.db"
+        db.init_db()
+
+    def tearDown(self):
+        db.close_pool()
+        db.DB_PATH = self._orig_path
+        self._tmp.cleanup()
+
+    def test_close_while_checked_out_closes_on_return(self):
+        with db.get_conn() as conn:
+            db.close_pool()
+        with self.assertRaises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1;")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from app import db
+from app import main
+
+
+class QueryPlanTest(unittest.TestCase):
+    """Newest-first reads must come off an index, not a temp B-tree sort."""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._orig_path = db.DB_PATH
+        db.DB_PATH = Path(self._tmp.name) / "app.db"
+        db.init_db()
+
+    def tearDown(self):
+        db.close_pool()
+        db.DB_PATH = self._orig_path
+        self._tmp.cleanup()
+
+    def _plan(self, sql, params=()):
+        with db.get_conn() as conn:
+            return [r["detail"] for r in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+    def assertNoSort(self, plan):
+        self.assertFalse([d for d in plan if "TEMP B-TREE" in d], plan)
+
+    def test_export_streams_from_index(self):
+        plan = self._plan(main.EXPORT_SQL)
+        self.assertIn("SCAN r USING INDEX idx_reviews_created", plan)
+        self.assertNoSort(plan)
+
+    def test_dashboard_queries_avoid_sort(self):
+        self.assertNoSort(self._plan(main.ADMIN_SQL_ALL, (1,)))
+        self.assertNoSort(self._plan(main.ADMIN_SQL_FILTERED, (1, 1)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+from app import db
+from app import main
+from app.models import ReviewCreate
+
+
+class InsertReviewsTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._orig_path = db.DB_PATH
+        db.DB_PATH = Path(self._tmp.name) / "app.db"
+        db.init_db()
+        main._load_businesses()
+
+    def tearDown(self):
+        db.close_pool()
+        db.DB_PATH = self._orig_path
+        self._tmp.cleanup()
+
+    def _reviews(self):
+        with db.get_conn() as conn:
+            return [tuple(r) for r in conn.execute("""
+                SELECT b.slug, r.rating, r.flagged FROM reviews r
+                JOIN businesses b ON b.id = r.business_id ORDER BY r.id;
+            """)]
+
+    def test_mixed_batch_with_new_and_duplicate_slugs(self):
+        payloads = [
+            ReviewCreate(business_slug="demo", rating=5),
+            ReviewCreate(business_slug="new-shop", rating=1),
+            ReviewCreate(business_slug="new-shop", rating=4),
+            ReviewCreate(business_slug="other-shop", rating=2),
+        ]
+
+        flags = main.create_reviews_bulk(payloads)
+
+        self.assertEqual(flags, [False, True, False, True])
+        self.assertEqual(self._reviews(), [
+            ("demo", 5, 0), ("new-shop", 1, 1), ("new-shop", 4, 0), ("other-shop", 2, 1),
+        ])
+        self.assertEqual(main._BIZ_BY_SLUG["new-shop"].name, "New Shop")
+        self.assertEqual(main._BIZ_BY_SLUG["other-shop"].name, "Other Shop")
+        with db.get_conn() as conn:
+            ids = dict(conn.execute("SELECT slug, id FROM businesses;").fetchall())
+        self.assertEqual({s: b.id for s, b in main._BIZ_BY_SLUG.items()}, ids)
+
+    def test_check_violation_rolls_back_whole_batch(self):
+        payloads = [
+            ReviewCreate(business_slug="fresh-shop", rating=3),
+            ReviewCreate.model_construct(
+                business_slug="fresh-shop", rating=9, comment=None, contact_email=None,
+            ),
+        ]
+
+        with self.assertRaises(sqlite3.IntegrityError):
+            main.create_reviews_bulk(payloads)
+
+        self.assertEqual(self._reviews(), [])
+        self.assertNotIn("fresh-shop", main._BIZ_BY_SLUG)
+        self.assertIsNone(main.get_business_by_slug("fresh-shop"))
+
+    def test_missing_business_is_not_silently_dropped(self):
+        payload = ReviewCreate(business_slug="ghost", rating=4)
+        # Stale cache entry: the row it points at does not exist
+        main._BIZ_BY_SLUG["ghost"] = main.Business(999, "ghost", "Ghost")
+
+        with self.assertRaises(RuntimeError):
+            main.create_reviews_bulk([payload])
+
+        self.assertEqual(self._reviews(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()